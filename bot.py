@@ -1,6 +1,7 @@
 import os
 import json
 import base64
+import asyncio
 import logging
 from datetime import datetime, timedelta
 from typing import Optional
@@ -31,6 +32,18 @@ TABLE_TRANSACTIONS = "Transactions"
 TABLE_HOLDINGS = "Holdings"
 TABLE_INVESTMENT_ACTIVITY = "Investment Activity"
 TABLE_MEMORY = "Memory"
+TABLE_FX_RATES = "FX Rates"
+
+# Currencies the user holds money in, and how long live FX rates stay fresh
+SUPPORTED_CURRENCIES = ["USD", "EUR", "COP", "AED"]
+BASE_CURRENCY = "USD"
+FX_CACHE_TTL = timedelta(hours=1)
+# FX data is optional context: fail fast and wait before retrying a failed fetch
+FX_RETRY_BACKOFF = timedelta(minutes=5)
+FX_FETCH_TIMEOUT = 3.0
+FX_FETCH_CONCURRENCY = 5
+FX_HISTORY_DEADLINE = 5.0  # seconds a message waits for historical rates
+FX_HISTORY_DAYS = 30  # window for converted totals
 
 # =============================================================================
 # AIRTABLE CLIENT
@@ -199,6 +212,36 @@ class AirtableClient:
     def delete_memory(self, record_id: str):
         table = self.get_table(TABLE_MEMORY)
         table.delete(record_id)
+    
+    # FX Rates
+    def save_fx_rates(self, rates_by_date: dict):
+        """Upsert {date: rates} in batches, so a date is never stored twice"""
+        if not rates_by_date:
+            return
+        table = self.get_table(TABLE_FX_RATES)
+        table.batch_upsert(
+            [{"fields": {"date": date, "base": BASE_CURRENCY, "rates": json.dumps(rates)}}
+             for date, rates in rates_by_date.items()],
+            key_fields=["date", "base"]
+        )
+    
+    def get_fx_rates(self, dates: list) -> dict:
+        """Return {date: rates} for every stored date in a single query"""
+        if not dates:
+            return {}
+        table = self.get_table(TABLE_FX_RATES)
+        date_filters = ", ".join(f"DATETIME_FORMAT({{date}}, 'YYYY-MM-DD') = '{d}'" for d in dates)
+        records = table.all(formula=f"AND({{base}} = '{BASE_CURRENCY}', OR({date_filters}))")
+        rates_by_date = {}
+        for r in records:
+            # Skip blank or malformed rows rather than losing the whole history
+            try:
+                rates = json.loads(r["fields"]["rates"])
+                if isinstance(rates, dict):
+                    rates_by_date[r["fields"]["date"]] = rates
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping bad FX Rates row {r.get('id')}: {e}")
+        return rates_by_date
 
 
 # =============================================================================
@@ -305,6 +348,189 @@ class PriceFetcher:
             return None
 
 
+# =============================================================================
+# FX RATES
+# =============================================================================
+class FXRateFetcher:
+    """Currency conversion with cached live rates and a persisted daily history.
+    
+    Rates are stored as units of each currency per 1 USD. Live rates are
+    cached in memory for FX_CACHE_TTL; past days never change, so they are
+    kept in memory and in the FX Rates table once fetched.
+    """
+    
+    def __init__(self, db: Optional[AirtableClient] = None):
+        self.db = db
+        self._latest: Optional[dict] = None
+        self._latest_fetched_at: Optional[datetime] = None
+        self._latest_failed_at: Optional[datetime] = None
+        self._history: dict = {}
+        self._unavailable: dict = {}  # date -> when its fetch last failed
+        self._in_flight: dict = {}  # date -> future resolved with its rates (or None)
+        self._resolving: set = set()  # keeps background lookup tasks referenced
+    
+    @staticmethod
+    async def _fetch_rates(client: httpx.AsyncClient, date: str = "latest") -> Optional[dict]:
+        """Fetch all supported rates for a day ("latest" or YYYY-MM-DD) in one call"""
+        urls = [
+            f"https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@{date}/v1/currencies/usd.json",
+            f"https://{date}.currency-api.pages.dev/v1/currencies/usd.json"
+        ]
+        for url in urls:
+            try:
+                response = await client.get(url)
+                response.raise_for_status()
+                data = response.json()["usd"]
+                return {c: float(data[c.lower()]) for c in SUPPORTED_CURRENCIES}
+            except Exception as e:
+                logger.warning(f"FX fetch failed for {date} from {url}: {e}")
+        return None
+    
+    async def get_latest_rates(self) -> Optional[dict]:
+        """Current rates, refreshed at most once per FX_CACHE_TTL"""
+        now = datetime.now()
+        if self._latest and now - self._latest_fetched_at < FX_CACHE_TTL:
+            return self._latest
+        if self._latest_failed_at and now - self._latest_failed_at < FX_RETRY_BACKOFF:
+            return self._latest
+        async with httpx.AsyncClient(timeout=FX_FETCH_TIMEOUT) as client:
+            rates = await self._fetch_rates(client)
+        if rates:
+            self._latest = rates
+            self._latest_fetched_at = now
+            self._latest_failed_at = None
+        else:
+            self._latest_failed_at = now
+        return self._latest
+    
+    async def get_rates_for_dates(self, dates: list) -> dict:
+        """Return {date: rates} for the past dates whose own rates are known.
+        
+        Dates that are today or later are not included (latest rates apply),
+        nor are past dates that could not be resolved within
+        FX_HISTORY_DEADLINE; slow lookups keep running in the background and
+        failed ones are retried after FX_RETRY_BACKOFF.
+        """
+        today = datetime.now().strftime("%Y-%m-%d")
+        now = datetime.now()
+        past = {d[:10] for d in dates if d and d[:10] < today}
+        
+        # Share in-flight lookups so concurrent messages don't fetch the same day twice
+        new_dates = [
+            d for d in past
+            if d not in self._history and d not in self._in_flight
+            and not (d in self._unavailable and now - self._unavailable[d] < FX_RETRY_BACKOFF)
+        ]
+        if new_dates:
+            loop = asyncio.get_running_loop()
+            for d in new_dates:
+                self._in_flight[d] = loop.create_future()
+            task = asyncio.create_task(self._resolve_history(new_dates))
+            self._resolving.add(task)
+            task.add_done_callback(self._resolving.discard)
+        
+        pending = [self._in_flight[d] for d in past if d in self._in_flight]
+        if pending:
+            await asyncio.wait(pending, timeout=FX_HISTORY_DEADLINE)
+        
+        return {d: self._history[d] for d in past if d in self._history}
+    
+    async def _resolve_history(self, dates: list):
+        """Resolve past days from Airtable, then the API, settling each date's future"""
+        def settle(date, rates):
+            future = self._in_flight.pop(date, None)
+            if rates:
+                self._history[date] = rates
+                self._unavailable.pop(date, None)
+            else:
+                self._unavailable[date] = datetime.now()
+            if future and not future.done():
+                future.set_result(rates)
+        
+        try:
+            stored = {}
+            if self.db:
+                try:
+                    stored = await asyncio.to_thread(self.db.get_fx_rates, dates)
+                except Exception as e:
+                    logger.warning(f"Could not load FX history: {e}")
+            for date, rates in stored.items():
+                if date in self._in_flight:
+                    settle(date, rates)
+            
+            to_fetch = [d for d in dates if d not in stored]
+            if not to_fetch:
+                return
+            semaphore = asyncio.Semaphore(FX_FETCH_CONCURRENCY)
+            new_rates = {}
+            
+            async def fetch(client, date):
+                async with semaphore:
+                    rates = await self._fetch_rates(client, date)
+                if rates:
+                    new_rates[date] = rates
+                settle(date, rates)
+            
+            async with httpx.AsyncClient(timeout=FX_FETCH_TIMEOUT) as client:
+                await asyncio.gather(*(fetch(client, d) for d in to_fetch))
+            
+            if new_rates and self.db:
+                try:
+                    await asyncio.to_thread(self.db.save_fx_rates, new_rates)
+                except Exception as e:
+                    logger.warning(f"Could not save FX rates: {e}")
+        except Exception as e:
+            logger.error(f"Error resolving FX history: {e}")
+        finally:
+            for date in dates:
+                if date in self._in_flight:
+                    settle(date, None)
+    
+    @staticmethod
+    def is_number(value) -> bool:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    
+    @classmethod
+    def convert(cls, amount: float, from_currency: str, to_currency: str, rates: Optional[dict]) -> Optional[float]:
+        """Convert an amount using a rates table (units per 1 USD); None if it can't"""
+        if not cls.is_number(amount):
+            return None
+        from_currency = (from_currency or BASE_CURRENCY).upper()
+        to_currency = to_currency.upper()
+        if from_currency == to_currency:
+            return amount
+        if not rates or from_currency not in rates or to_currency not in rates:
+            return None
+        return amount / rates[from_currency] * rates[to_currency]
+    
+    async def convert_batch(self, amounts: list, currencies: list, dates: Optional[list] = None,
+                            to_currency: str = BASE_CURRENCY) -> tuple:
+        """Convert many amounts at once, resolving each distinct date's rates only once.
+        
+        Returns (converted, approximate). Entries that cannot be converted
+        (non-numeric amount or missing rate) are None in converted. An entry
+        is approximate when it is dated in the past but its own day's rates
+        were unavailable, so the latest rates were used instead.
+        """
+        latest = await self.get_latest_rates()
+        if dates is None:
+            dates = [None] * len(amounts)
+        rates_by_date = await self.get_rates_for_dates(dates)
+        today = datetime.now().strftime("%Y-%m-%d")
+        
+        converted, approximate = [], []
+        for amount, currency, date in zip(amounts, currencies, dates):
+            day = date[:10] if date else None
+            rates = rates_by_date.get(day, latest)
+            value = self.convert(amount, currency, to_currency, rates)
+            converted.append(value)
+            approximate.append(
+                value is not None and day is not None and day < today and day not in rates_by_date
+                and (currency or BASE_CURRENCY).upper() != to_currency.upper()
+            )
+        return converted, approximate
+
+
 # =============================================================================
 # MAIN BOT
 # =============================================================================
@@ -314,27 +540,83 @@ class YellowTrackerBot:
         self.claude = ClaudeClient()
         self.groq = GroqClient()
         self.price_fetcher = PriceFetcher()
+        self.fx = FXRateFetcher(self.db)
+    
+    async def build_fx_summary(self, transactions: list, holdings: list) -> Optional[dict]:
+        """Convert transactions (at their own date's rate) and holdings cost basis to USD"""
+        rates = await self.fx.get_latest_rates()
+        if not rates:
+            return None
+        
+        # Only shown transactions and those inside the totals window need converting
+        cutoff = (datetime.now() - timedelta(days=FX_HISTORY_DAYS)).strftime("%Y-%m-%d")
+        tx_fields = [tx["fields"] for tx in transactions]
+        used = [i for i, f in enumerate(tx_fields) if i < 30 or (f.get("Date") or "") >= cutoff]
+        converted, approximate = await self.fx.convert_batch(
+            [tx_fields[i].get("Amount") for i in used],
+            [tx_fields[i].get("Currency") for i in used],
+            [tx_fields[i].get("Date") for i in used]
+        )
+        tx_usd = [None] * len(transactions)
+        tx_approximate = [False] * len(transactions)
+        for i, usd, approx in zip(used, converted, approximate):
+            tx_usd[i], tx_approximate[i] = usd, approx
+        
+        h_fields = [h["fields"] for h in holdings]
+        costs = []
+        for f in h_fields:
+            shares, avg_cost = f.get("shares"), f.get("avg_cost")
+            is_numeric = self.fx.is_number(shares) and self.fx.is_number(avg_cost)
+            costs.append(shares * avg_cost if is_numeric else None)
+        holdings_usd, _ = await self.fx.convert_batch(costs, [f.get("currency") for f in h_fields])
+        
+        # Totals per type over the last 30 days
+        totals = {}
+        approximate_totals = set()
+        for f, usd, approx in zip(tx_fields, tx_usd, tx_approximate):
+            if usd is not None and (f.get("Date") or "") >= cutoff:
+                totals[f.get("Type")] = totals.get(f.get("Type"), 0) + usd
+                if approx:
+                    approximate_totals.add(f.get("Type"))
+        
+        return {
+            "rates": rates,
+            "tx_usd": tx_usd,
+            "tx_approximate": tx_approximate,
+            "holdings_usd": holdings_usd,
+            "totals_30d": totals,
+            "approximate_totals": approximate_totals,
+            "portfolio_cost_usd": sum(v for v in holdings_usd if v is not None)
+        }
     
     def build_system_prompt(self, user_id: str, transactions: list, holdings: list, 
-                           activities: list, memories: list) -> str:
+                           activities: list, memories: list, fx_summary: Optional[dict] = None) -> str:
         """Build the system prompt with all user context"""
+        fx_summary = fx_summary or {}
+        tx_usd = fx_summary.get("tx_usd") or [None] * len(transactions)
+        tx_approximate = fx_summary.get("tx_approximate") or [False] * len(transactions)
+        holdings_usd = fx_summary.get("holdings_usd") or [None] * len(holdings)
         
         # Format transactions
         transactions_text = "No recent transactions."
         if transactions:
             tx_lines = []
-            for tx in transactions[:30]:  # Last 30 transactions
+            for tx, usd, approximate in list(zip(transactions, tx_usd, tx_approximate))[:30]:  # Last 30 transactions
                 f = tx["fields"]
-                tx_lines.append(f"- {f.get('Date')}: {f.get('Type')} {f.get('Amount')} {f.get('Currency')} - {f.get('Category')} - {f.get('Description')} (Payment: {f.get('Payment Method')} {f.get('Payment Source') or ''}) [ID: {tx['id']}]")
+                usd_text = ""
+                if usd is not None and (f.get("Currency") or BASE_CURRENCY).upper() != BASE_CURRENCY:
+                    usd_text = f" (≈ {usd:,.2f} USD{' at today’s rate, historical rate unavailable' if approximate else ''})"
+                tx_lines.append(f"- {f.get('Date')}: {f.get('Type')} {f.get('Amount')} {f.get('Currency')}{usd_text} - {f.get('Category')} - {f.get('Description')} (Payment: {f.get('Payment Method')} {f.get('Payment Source') or ''}) [ID: {tx['id']}]")
             transactions_text = "\n".join(tx_lines)
         
         # Format holdings
         holdings_text = "No holdings."
         if holdings:
             h_lines = []
-            for h in holdings:
+            for h, usd in zip(holdings, holdings_usd):
                 f = h["fields"]
-                h_lines.append(f"- {f.get('ticker')} ({f.get('asset_type')}): {f.get('shares')} units @ avg {f.get('avg_cost')} {f.get('currency')} on {f.get('platform')} [ID: {h['id']}]")
+                usd_text = f" (cost ≈ {usd:,.2f} USD)" if usd is not None else ""
+                h_lines.append(f"- {f.get('ticker')} ({f.get('asset_type')}): {f.get('shares')} units @ avg {f.get('avg_cost')} {f.get('currency')}{usd_text} on {f.get('platform')} [ID: {h['id']}]")
             holdings_text = "\n".join(h_lines)
         
         # Format activities
@@ -352,6 +634,22 @@ class YellowTrackerBot:
             m_lines = [f"- [{m['fields'].get('category')}] {m['fields'].get('fact')}" for m in memories]
             memories_text = "\n".join(m_lines)
         
+        # Format FX rates and converted totals
+        fx_text = "FX rates unavailable right now. Do not guess conversions; state amounts in their own currency."
+        rates = fx_summary.get("rates")
+        if rates:
+            fx_lines = [f"- 1 USD = {rates[c]:,.4f} {c}" for c in SUPPORTED_CURRENCIES if c != "USD"]
+            approximate_totals = fx_summary.get("approximate_totals", set())
+            for tx_type, total in sorted(fx_summary.get("totals_30d", {}).items(), key=lambda kv: str(kv[0])):
+                note = " (approximate: some items use today’s rate)" if tx_type in approximate_totals else ""
+                fx_lines.append(f"- Total {tx_type} (last 30 days): {total:,.2f} USD{note}")
+            valued = [v for v in holdings_usd if v is not None]
+            if valued:
+                skipped = len(holdings) - len(valued)
+                note = f" (excludes {skipped} holding(s) without cost data)" if skipped else ""
+                fx_lines.append(f"- Portfolio cost basis: {fx_summary.get('portfolio_cost_usd', 0):,.2f} USD{note}")
+            fx_text = "\n".join(fx_lines)
+        
         return f"""You are Yellow Tracker, a personal AI financial assistant. You help the user track their expenses, income, investments, and overall financial life through natural conversation.
 
 ## YOUR CAPABILITIES
@@ -378,6 +676,9 @@ You can:
 ### Memories (things you know about this user):
 {memories_text}
 
+### Currency Conversion (computed from real rates; past transactions use their own date's rate unless marked as using today's rate):
+{fx_text}
+
 ## HOW TO RESPOND
 
 You must ALWAYS respond with valid JSON in this exact format:
@@ -422,7 +723,7 @@ stock, crypto, etf, bond, commodity, real estate, other
 4. **Ask for clarification** when truly needed, but make reasonable assumptions when you can.
 5. **Remember things**: If user mentions something worth remembering (preferences, recurring expenses, etc.), save it to memory.
 6. **Multiple actions**: You can perform multiple actions in one response if needed.
-7. **Currency handling**: User's currencies are USD, EUR, COP, AED. Default to USD if unclear.
+7. **Currency handling**: User's currencies are USD, EUR, COP, AED. Default to USD if unclear. For multi-currency totals, use the USD conversions provided above instead of estimating rates.
 8. **European decimals**: 31,50 means 31.50
 
 Current date: {datetime.now().strftime("%Y-%m-%d %H:%M")}
@@ -438,9 +739,16 @@ Current date: {datetime.now().strftime("%Y-%m-%d %H:%M")}
         activities = self.db.get_activities(str(user_id))
         memories = self.db.get_memories(str(user_id))
         
+        # Convert everything to USD so totals don't depend on guessed rates
+        try:
+            fx_summary = await self.build_fx_summary(transactions, holdings)
+        except Exception as e:
+            logger.error(f"Error converting currencies: {e}")
+            fx_summary = None
+        
         # Build system prompt
         system_prompt = self.build_system_prompt(
-            str(user_id), transactions, holdings, activities, memories
+            str(user_id), transactions, holdings, activities, memories, fx_summary
         )
         
         # Build messages for Claude